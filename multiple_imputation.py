@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+LoRTISA Multiple Imputation - Chained equations with Rubin's rules pooling
+Produces M completed datasets in parallel worker processes, runs the
+hospital/district/urban-rural analyses on each and pools the estimates.
+
+Each completed dataset is held as a delta over a shared base frame: only the
+values imputed at the missing positions are stored per imputation.
+"""
+
+import multiprocessing
+import os
+import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Variables imputed by chained equations and the model used for each.
+# died_hospital is not modelled: an in-hospital death implies death within
+# 30 days, so it only fills died_30day deterministically (see prepare_base).
+IMPUTATION_MODELS = {
+    'died_30day': 'logistic',
+    'bmi': 'linear',
+}
+
+# Predictors used in the chained equations. Any that is absent or incomplete in
+# an export is dropped with a warning (see prepare_base) rather than imputed.
+AUXILIARY_VARIABLES = [
+    'hiv_positive', 'age_continuous', 'male', 'spo2_low', 'rr_high', 'hr_high',
+    'sbp_low', 'clinical_severe', 'comorbidity_count', 'tb_history',
+    'hospital_kirrudu', 'hospital_mulago', 'region_central',
+]
+
+# Geographic stratifications analysed on every completed dataset
+GEOGRAPHIC_LEVELS = {
+    'Hospital': 'hospital_clean',
+    'District': 'district_clean',
+    'Urban-Rural': 'urban_rural',
+}
+
+# Estimands pooled per stratum, as percentages like the complete-case tables
+ESTIMANDS = {
+    'mortality_rate': 'died_30day',
+    'hiv_prevalence': 'hiv_positive',
+}
+
+# Set in each worker process by _init_worker so the base frame is sent once
+_BASE = None
+
+
+def prepare_base(data):
+    """Build the numeric base frame shared by all imputations."""
+    base = pd.DataFrame(index=data.index)
+    for col in IMPUTATION_MODELS:
+        base[col] = data[col].astype(float)
+
+    # Logical imputation: died in hospital => died within 30 days
+    died_in_hospital = data['died_hospital'] == 1
+    base.loc[died_in_hospital & base['died_30day'].isna(), 'died_30day'] = 1.0
+
+    for col in AUXILIARY_VARIABLES:
+        if col == 'male':
+            values = (data['patient_gender'] == 'Male').astype(float)
+        elif col in data:
+            values = data[col].astype(float)
+        else:
+            warnings.warn(f"Auxiliary variable '{col}' not in dataset; left out of the imputation model")
+            continue
+        if values.isna().any():
+            warnings.warn(f"Auxiliary variable '{col}' has {int(values.isna().sum())} missing "
+                          f"values; left out of the imputation model")
+            continue
+        base[col] = values
+    for col in GEOGRAPHIC_LEVELS.values():
+        base[col] = data[col]
+    return base.reset_index(drop=True)
+
+
+def auxiliary_columns(base):
+    """Auxiliary predictors that prepare_base kept for this dataset."""
+    return [col for col in AUXILIARY_VARIABLES if col in base]
+
+
+def missing_positions(base):
+    """Row positions of missing values for every imputed variable that has any."""
+    positions = {}
+    for col in IMPUTATION_MODELS:
+        pos = np.flatnonzero(base[col].isna().to_numpy())
+        if len(pos) > 0:
+            positions[col] = pos
+    return positions
+
+
+def _draw_linear(X_obs, y_obs, X_mis, rng):
+    """Bayesian linear regression draw (van Buuren's norm method)."""
+    XtX_inv = np.linalg.pinv(X_obs.T @ X_obs)
+    beta_hat = XtX_inv @ X_obs.T @ y_obs
+    residuals = y_obs - X_obs @ beta_hat
+    dof = max(len(y_obs) - X_obs.shape[1], 1)
+    sigma2 = residuals @ residuals / rng.chisquare(dof)
+    beta = rng.multivariate_normal(beta_hat, sigma2 * XtX_inv)
+    return X_mis @ beta + rng.normal(0.0, np.sqrt(sigma2), size=len(X_mis))
+
+
+def _augment(X_obs, y_obs):
+    """
+    Augmented-data records guarding against perfect prediction (White, Daniel &
+    Royston 2010; mice's logreg): for each predictor, points at its mean +/- one
+    SD with both outcomes, together weighing as p + 1 observations.
+    """
+    n_pred = X_obs.shape[1] - 1
+    means = X_obs[:, 1:].mean(axis=0)
+    sds = X_obs[:, 1:].std(axis=0)
+    rows = []
+    for j in range(n_pred):
+        for sign in (-1.0, 1.0):
+            point = means.copy()
+            point[j] += sign * sds[j]
+            rows.append(point)
+    X_aug = np.column_stack([np.ones(len(rows)), np.array(rows)])
+    X_aug = np.vstack([X_aug, X_aug])
+    y_aug = np.repeat([0.0, 1.0], len(rows))
+    w_aug = np.full(len(y_aug), (n_pred + 1) / len(y_aug))
+
+    X = np.vstack([X_obs, X_aug])
+    y = np.concatenate([y_obs, y_aug])
+    w = np.concatenate([np.ones(len(y_obs)), w_aug])
+    return X, y, w
+
+
+def _draw_logistic(X_obs, y_obs, X_mis, rng, ridge=1e-2, max_iter=50):
+    """
+    Logistic regression by weighted IRLS on augmented data, then a draw from the
+    approximate posterior; stays finite under separation.
+    """
+    X, y, weights = _augment(X_obs, y_obs)
+    beta = np.zeros(X.shape[1])
+    penalty = ridge * np.eye(X.shape[1])
+    penalty[0, 0] = 0.0
+    for _ in range(max_iter):
+        p = 1.0 / (1.0 + np.exp(-(X @ beta)))
+        w = weights * p * (1.0 - p)
+        hessian = X.T @ (X * w[:, None]) + penalty
+        step = np.linalg.solve(hessian, X.T @ (weights * (y - p)) - penalty @ beta)
+        beta = beta + step
+        if np.max(np.abs(step)) < 1e-8:
+            break
+    p = 1.0 / (1.0 + np.exp(-(X @ beta)))
+    hessian = X.T @ (X * (weights * p * (1.0 - p))[:, None]) + penalty
+    beta_draw = rng.multivariate_normal(beta, np.linalg.inv(hessian))
+    p_mis = 1.0 / (1.0 + np.exp(-(X_mis @ beta_draw)))
+    return (rng.random(len(X_mis)) < p_mis).astype(float)
+
+
+def impute_once(base, positions, seed, n_iter=10):
+    """
+    Run one chain of MICE and return its delta: imputed values keyed by
+    variable, aligned with `positions`.
+    """
+    rng = np.random.default_rng(seed)
+    model_cols = list(IMPUTATION_MODELS) + auxiliary_columns(base)
+    matrix = base[model_cols].to_numpy(dtype=float, copy=True)
+
+    # Standardise predictors so the ridge penalty and IRLS behave uniformly
+    means = np.nanmean(matrix, axis=0)
+    scales = np.nanstd(matrix, axis=0)
+    scales[scales == 0] = 1.0
+
+    # Start from random draws of the observed values
+    for col, pos in positions.items():
+        j = model_cols.index(col)
+        observed = matrix[~np.isnan(matrix[:, j]), j]
+        matrix[pos, j] = rng.choice(observed, size=len(pos))
+
+    for _ in range(n_iter):
+        for col, pos in positions.items():
+            j = model_cols.index(col)
+            observed_rows = np.ones(len(matrix), dtype=bool)
+            observed_rows[pos] = False
+
+            others = np.delete((matrix - means) / scales, j, axis=1)
+            X = np.column_stack([np.ones(len(matrix)), others])
+            y = matrix[observed_rows, j]
+
+            if IMPUTATION_MODELS[col] == 'logistic':
+                matrix[pos, j] = _draw_logistic(X[observed_rows], y, X[pos], rng)
+            else:
+                matrix[pos, j] = _draw_linear(X[observed_rows], y, X[pos], rng)
+
+    return {col: matrix[pos, model_cols.index(col)] for col, pos in positions.items()}
+
+
+def complete(base, positions, delta):
+    """Materialise a completed dataset; only the imputed columns are copied."""
+    completed = base.copy(deep=False)
+    for col, values in delta.items():
+        column = base[col].to_numpy(copy=True)
+        column[positions[col]] = values
+        completed[col] = column
+    return completed
+
+
+def analyse(completed):
+    """Per-stratum estimates and within-imputation variances for one dataset."""
+    rows = []
+    for level, stratum_col in GEOGRAPHIC_LEVELS.items():
+        for stratum, group in completed.groupby(stratum_col):
+            n = len(group)
+            for estimand, outcome in ESTIMANDS.items():
+                p = group[outcome].mean()
+                rows.append({
+                    'level': level,
+                    'stratum': stratum,
+                    'estimand': estimand,
+                    'n_patients': n,
+                    'estimate': p * 100,
+                    'variance': p * (1 - p) / n * 100 ** 2,
+                })
+    return pd.DataFrame(rows)
+
+
+def _init_worker(base):
+    global _BASE
+    _BASE = base
+
+
+def _impute_and_analyse(task):
+    positions, seed, n_iter = task
+    delta = impute_once(_BASE, positions, seed, n_iter)
+    return delta, analyse(complete(_BASE, positions, delta))
+
+
+def _default_workers(m):
+    # Worker processes are forked so that this works from the top-level
+    # analysis scripts, which have no __main__ guard for spawn to respect.
+    # Forking is unsafe with macOS system frameworks, so run serially there.
+    if sys.platform == 'darwin' or 'fork' not in multiprocessing.get_all_start_methods():
+        return 1
+    return min(m, os.cpu_count() or 1)
+
+
+def run_imputations(base, m=20, n_iter=10, seed=123, workers=None):
+    """
+    Produce M imputations and their analyses.
+
+    Returns (positions, deltas, estimates) where deltas[i] holds the imputed
+    values of imputation i and estimates[i] its per-stratum analysis.
+    """
+    positions = missing_positions(base)
+    seeds = [s.generate_state(1)[0] for s in np.random.SeedSequence(seed).spawn(m)]
+    tasks = [(positions, int(s), n_iter) for s in seeds]
+    workers = workers or _default_workers(m)
+
+    if workers == 1:
+        _init_worker(base)
+        results = [_impute_and_analyse(task) for task in tasks]
+    else:
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(base,)) as pool:
+            results = list(pool.map(_impute_and_analyse, tasks))
+
+    deltas = [delta for delta, _ in results]
+    estimates = [est for _, est in results]
+    return positions, deltas, estimates
+
+
+def pool_rubin(estimates, alpha=0.05):
+    """Pool per-imputation estimates with Rubin's rules."""
+    m = len(estimates)
+    keys = ['level', 'stratum', 'estimand']
+    stacked = pd.concat(estimates, ignore_index=True)
+    grouped = stacked.groupby(keys, sort=False)
+
+    pooled = grouped.agg(
+        n_patients=('n_patients', 'first'),
+        estimate=('estimate', 'mean'),
+        within_variance=('variance', 'mean'),
+        between_variance=('estimate', lambda q: q.var(ddof=1) if q.nunique() > 1 else 0.0),
+    )
+    total = pooled['within_variance'] + (1 + 1 / m) * pooled['between_variance']
+    pooled['std_error'] = np.sqrt(total)
+
+    # Rubin (1987) degrees of freedom; infinite when imputation adds no variance
+    relative_increase = (1 + 1 / m) * pooled['between_variance'] / pooled['within_variance']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dof = (m - 1) * (1 + 1 / relative_increase) ** 2
+    pooled['df'] = dof.where(pooled['between_variance'] > 0, np.inf)
+    pooled['fraction_missing_info'] = ((1 + 1 / m) * pooled['between_variance'] / total).fillna(0.0)
+
+    t_crit = stats.t.ppf(1 - alpha / 2, pooled['df'])
+    pooled['ci_lower'] = pooled['estimate'] - t_crit * pooled['std_error']
+    pooled['ci_upper'] = pooled['estimate'] + t_crit * pooled['std_error']
+    pooled['n_imputations'] = m
+    return pooled
+
+
+def run_pooled_geographic_analysis(data, m=20, n_iter=10, seed=123, workers=None,
+                                   min_district_patients=20):
+    """
+    Impute, analyse and pool; districts below the size threshold are dropped.
+
+    Returns (pooled, positions, auxiliary): the pooled table, the row positions
+    that were imputed per variable, and the auxiliary predictors actually used.
+    """
+    base = prepare_base(data)
+    positions, _, estimates = run_imputations(base, m=m, n_iter=n_iter, seed=seed,
+                                              workers=workers)
+    pooled = pool_rubin(estimates)
+
+    level = pooled.index.get_level_values('level')
+    small = (level == 'District') & (pooled['n_patients'] < min_district_patients)
+    return pooled[~small], positions, auxiliary_columns(base)
@@ -12,6 +12,13 @@ import numpy as np
 from datetime import datetime
 import os
 
+import multiple_imputation
+import record_linkage
+import results_store
+
+# Minimum patients for a district to be reported; also recorded in the manifest
+MIN_DISTRICT_PATIENTS = 20
+
 # Ensure Results directories exist
 os.makedirs('Results/Figures', exist_ok=True)
 os.makedirs('Results/Tables', exist_ok=True)
@@ -28,23 +35,32 @@ except FileNotFoundError:
     print("Error: LoRTISA_analysis_dataset_corrected.csv not found")
     exit(1)
 
-# Clean data for analysis
-geo_data = data.dropna(subset=['died_30day']).copy()
-
-# Standardize geographic variables
-geo_data['hospital_clean'] = geo_data['hospital'].map({
+# Link REDCap events and identifier variants to one record per patient, and
+# flag probable duplicate patients before any stratum counts are taken
+n_source_records = len(data)
+data, duplicate_candidates = record_linkage.link_records(data)
+n_flagged_duplicates = int(data['possible_duplicate'].sum())
+print(f"Record linkage: {n_source_records} records -> {len(data)} linked records, "
+      f"{n_flagged_duplicates} flagged as possible duplicates")
+
+# Standardize geographic variables (on the full dataset, which the
+# multiple-imputation sensitivity analysis below also uses)
+data['hospital_clean'] = data['hospital'].map({
     'Kirrudu': 'Kirrudu',
     'Mulago': 'Mulago', 
     'Naguru': 'Naguru'
 })
 
-geo_data['district_clean'] = geo_data['residencedistrict'].str.title()
+data['district_clean'] = data['residencedistrict'].str.title()
 
 # Create urban vs rural classification
-geo_data['urban_rural'] = geo_data['residencedistrict'].apply(
+data['urban_rural'] = data['residencedistrict'].apply(
     lambda x: 'Urban' if x.lower() in ['kampala', 'wakiso'] else 'Rural/Peri-urban'
 )
 
+# Clean data for complete-case analysis
+geo_data = data.dropna(subset=['died_30day']).copy()
+
 print(f"Geographic analysis data: {len(geo_data)} participants")
 
 # =============================================================================
@@ -59,7 +75,7 @@ hospital_analysis = geo_data.groupby('hospital_clean').agg({
     'died_30day': ['sum', 'mean'],
     'hiv_positive': ['sum', 'mean'],
     'age_continuous': 'median'
-}).round(1)
+})
 
 # Flatten column names
 hospital_analysis.columns = ['n_patients', 'mortality_30day', 'mortality_rate', 
@@ -92,13 +108,13 @@ print(f"HIV prevalence differences p-value: {hiv_p:.4f}")
 
 print("\n=== DISTRICT-LEVEL ANALYSIS ===")
 
-# Focus on districts with ≥20 patients
+# Focus on districts with at least MIN_DISTRICT_PATIENTS patients
 district_analysis = geo_data.groupby('district_clean').agg({
     'patient_id': 'count',
     'died_30day': ['sum', 'mean'],
     'hiv_positive': ['sum', 'mean'],
     'age_continuous': 'median'
-}).round(1)
+})
 
 # Flatten column names
 district_analysis.columns = ['n_patients', 'mortality_30day', 'mortality_rate', 
@@ -107,10 +123,10 @@ district_analysis['mortality_rate'] *= 100
 district_analysis['hiv_prevalence'] *= 100
 
 # Filter for adequate sample sizes
-district_analysis = district_analysis[district_analysis['n_patients'] >= 20]
+district_analysis = district_analysis[district_analysis['n_patients'] >= MIN_DISTRICT_PATIENTS]
 district_analysis = district_analysis.sort_values('n_patients', ascending=False)
 
-print("District analysis (>=20 patients):")
+print(f"District analysis (>={MIN_DISTRICT_PATIENTS} patients):")
 print(district_analysis)
 
 # Urban vs Rural analysis
@@ -119,7 +135,7 @@ urban_rural_analysis = geo_data.groupby('urban_rural').agg({
     'died_30day': ['sum', 'mean'],
     'hiv_positive': ['sum', 'mean'],
     'age_continuous': 'median'
-}).round(1)
+})
 
 # Flatten column names
 urban_rural_analysis.columns = ['n_patients', 'mortality_30day', 'mortality_rate', 
@@ -130,6 +146,30 @@ urban_rural_analysis['hiv_prevalence'] *= 100
 print("\nUrban vs Rural comparison:")
 print(urban_rural_analysis)
 
+# =============================================================================
+# ANALYSIS 3: MULTIPLE IMPUTATION SENSITIVITY ANALYSIS
+# =============================================================================
+
+print("\n=== MULTIPLE IMPUTATION SENSITIVITY ANALYSIS ===")
+
+# Chained equations over the analysis variables, pooled with Rubin's rules
+n_imputations = 20
+imputation_iterations = 10
+imputation_seed = 123
+pooled_analysis, imputed_positions, imputation_predictors = (
+    multiple_imputation.run_pooled_geographic_analysis(
+        data, m=n_imputations, n_iter=imputation_iterations, seed=imputation_seed,
+        min_district_patients=MIN_DISTRICT_PATIENTS
+    )
+)
+n_imputed_outcomes = len(imputed_positions.get('died_30day', []))
+
+print(f"Imputed datasets: {n_imputations} ({n_imputed_outcomes} missing 30-day outcomes imputed)")
+print("Pooled 30-day mortality (%):")
+print(pooled_analysis.xs('mortality_rate', level='estimand')[
+    ['n_patients', 'estimate', 'ci_lower', 'ci_upper']
+])
+
 # =============================================================================
 # VISUALIZATION 1: HOSPITAL OUTCOMES COMPARISON
 # =============================================================================
@@ -223,7 +263,7 @@ if len(district_analysis) > 0:
     ax.set_title('District-Level 30-Day Mortality Rates', fontsize=16, fontweight='bold')
     ax.set_xlabel('District (Sample Size)', fontsize=12, fontweight='bold')
     ax.set_ylabel('30-Day Mortality Rate (%)', fontsize=12, fontweight='bold')
-    ax.text(0.5, -0.15, 'Only districts with >=20 patients shown', 
+    ax.text(0.5, -0.15, f'Only districts with >={MIN_DISTRICT_PATIENTS} patients shown', 
             transform=ax.transAxes, ha='center', style='italic')
     
     plt.tight_layout()
@@ -271,19 +311,67 @@ print("+ Figure 15 saved")
 
 print("\n=== SAVING GEOSPATIAL ANALYSIS RESULTS ===")
 
-# Save hospital analysis
-hospital_analysis.to_csv('Results/Tables/Hospital_Geographic_Analysis.csv')
+# Parameters recorded in the manifest so downstream jobs can check freshness
+analysis_parameters = {
+    'dataset': 'LoRTISA_analysis_dataset_corrected.csv',
+    'dataset_sha256': results_store.file_sha256('LoRTISA_analysis_dataset_corrected.csv'),
+    'outcome': 'died_30day',
+    'urban_districts': ['kampala', 'wakiso'],
+    'min_district_patients': MIN_DISTRICT_PATIENTS,
+}
+producer = os.path.basename(__file__)
+
+# Full-precision columnar artifacts; CSVs below are rounded views of these
+results_store.write_table('hospital_geographic_analysis', hospital_analysis,
+                          analysis_parameters, producer)
+results_store.render_csv('hospital_geographic_analysis',
+                         'Results/Tables/Hospital_Geographic_Analysis.csv')
 print("+ Hospital analysis saved")
 
-# Save district analysis  
 if len(district_analysis) > 0:
-    district_analysis.to_csv('Results/Tables/District_Geographic_Analysis.csv')
+    results_store.write_table('district_geographic_analysis', district_analysis,
+                              analysis_parameters, producer)
+    results_store.render_csv('district_geographic_analysis',
+                             'Results/Tables/District_Geographic_Analysis.csv')
     print("+ District analysis saved")
+else:
+    results_store.remove_table('district_geographic_analysis')
 
-# Save urban-rural analysis
-urban_rural_analysis.to_csv('Results/Tables/Urban_Rural_Analysis.csv')
+results_store.write_table('urban_rural_analysis', urban_rural_analysis,
+                          analysis_parameters, producer)
+results_store.render_csv('urban_rural_analysis',
+                         'Results/Tables/Urban_Rural_Analysis.csv')
 print("+ Urban-rural analysis saved")
 
+results_store.write_table('pooled_geographic_analysis', pooled_analysis,
+                          dict(analysis_parameters, n_imputations=n_imputations,
+                               imputation_iterations=imputation_iterations,
+                               imputation_seed=imputation_seed,
+                               imputation_models=multiple_imputation.IMPUTATION_MODELS,
+                               auxiliary_variables=imputation_predictors),
+                          producer)
+results_store.render_csv('pooled_geographic_analysis',
+                         'Results/Tables/Pooled_Geographic_Analysis.csv', decimals=3)
+print("+ Multiple imputation analysis saved")
+
+results_store.write_table('record_linkage_candidates', duplicate_candidates,
+                          analysis_parameters, producer)
+print("+ Record linkage candidates saved")
+
+# Statistical tests kept at full precision alongside the tables
+geospatial_tests = pd.DataFrame({
+    'comparison': ['hospital_mortality', 'hospital_hiv_prevalence'],
+    'test': ['chi-square', 'chi-square'],
+    'statistic': [mortality_chi2, hiv_chi2],
+    'p_value': [mortality_p, hiv_p],
+}).set_index('comparison')
+results_store.write_table('geospatial_tests', geospatial_tests,
+                          analysis_parameters, producer)
+print("+ Statistical tests saved")
+
+# Key findings below are formatted from the stored tests, not the in-memory p-values
+geospatial_tests = results_store.read_table('geospatial_tests')
+
 # Create comprehensive geospatial summary
 geospatial_summary = pd.DataFrame({
     'Figure': ['Figure13', 'Figure14', 'Figure15'],
@@ -298,14 +386,18 @@ geospatial_summary = pd.DataFrame({
         'Figure15_Urban_Rural_Analysis.png'
     ],
     'Key_Finding': [
-        f"Hospital HIV prevalence varies significantly (p={hiv_p:.3f})",
+        f"Hospital HIV prevalence varies significantly (p={geospatial_tests.loc['hospital_hiv_prevalence', 'p_value']:.3f})",
         f"District mortality ranges from {district_analysis['mortality_rate'].min():.1f}% to {district_analysis['mortality_rate'].max():.1f}%" if len(district_analysis) > 0 else "Limited district data",
         f"Urban vs rural mortality: {urban_rural_analysis.loc['Urban', 'mortality_rate']:.1f}% vs {urban_rural_analysis.loc['Rural/Peri-urban', 'mortality_rate']:.1f}%"
     ],
     'Geographic_Level': ['Hospital', 'District', 'Urban-Rural']
 })
 
-geospatial_summary.to_csv('Results/Tables/Geospatial_Analysis_Summary.csv', index=False)
+results_store.write_table('geospatial_analysis_summary', geospatial_summary,
+                          analysis_parameters, producer)
+results_store.render_csv('geospatial_analysis_summary',
+                         'Results/Tables/Geospatial_Analysis_Summary.csv', index=False)
+print(f"+ Manifest written to {results_store.manifest_path()}")
 
 # =============================================================================
 # CREATE MARKDOWN SUMMARY
@@ -313,11 +405,23 @@ geospatial_summary.to_csv('Results/Tables/Geospatial_Analysis_Summary.csv', inde
 
 print("\n=== CREATING GEOSPATIAL MARKDOWN SUMMARY ===")
 
+# The summary is rendered from the stored artifacts, not the in-memory frames
+hospital_analysis = results_store.read_table('hospital_geographic_analysis')
+urban_rural_analysis = results_store.read_table('urban_rural_analysis')
+if len(district_analysis) > 0:
+    district_analysis = results_store.read_table('district_geographic_analysis')
+geospatial_summary = results_store.read_table('geospatial_analysis_summary')
+pooled_analysis = results_store.read_table('pooled_geographic_analysis')
+geospatial_tests = results_store.read_table('geospatial_tests')
+mortality_p = geospatial_tests.loc['hospital_mortality', 'p_value']
+hiv_p = geospatial_tests.loc['hospital_hiv_prevalence', 'p_value']
+
 markdown_content = f"""# LoRTISA Geospatial Analysis Results Summary
 
 **Analysis Date:** {datetime.now().strftime('%Y-%m-%d')}  
 **Dataset:** LoRTISA Community-Acquired Pneumonia Study, Uganda  
 **Sample Size:** {len(geo_data)} participants with geographic data  
+**Record Linkage:** {n_source_records} source records linked to {len(data)} records; {n_flagged_duplicates} flagged as possible duplicates  
 
 ## Geographic Coverage
 
@@ -344,6 +448,21 @@ markdown_content = f"""# LoRTISA Geospatial Analysis Results Summary
 ### Urban vs Rural Comparison
 {chr(10).join([f"- **{category}:** {int(row['n_patients'])} patients, {row['mortality_rate']:.1f}% mortality, {row['hiv_prevalence']:.1f}% HIV prevalence" for category, row in urban_rural_analysis.iterrows()])}
 
+## Result Tables
+
+### Hospital Geographic Analysis
+{results_store.render_markdown('hospital_geographic_analysis')}
+
+### Urban vs Rural Analysis
+{results_store.render_markdown('urban_rural_analysis')}
+
+### Multiple Imputation Sensitivity Analysis
+Missing values in the analysis variables were imputed by chained equations ({n_imputations} imputations, {n_imputed_outcomes} missing 30-day outcomes) and estimates pooled with Rubin's rules.
+
+{chr(10).join([f"- **{stratum} ({level}):** {row['estimate']:.1f}% mortality (95% CI {row['ci_lower']:.1f}-{row['ci_upper']:.1f}), n = {int(row['n_patients'])}" for (level, stratum), row in pooled_analysis.xs('mortality_rate', level='estimand').iterrows()])}
+
+Full-precision tables are stored as Arrow files in `{results_store.ARTIFACT_DIR}`; see `{results_store.MANIFEST_NAME}` for schemas, row counts, and content hashes.
+
 ## Figures Generated
 
 ### Hospital Geographic Analysis
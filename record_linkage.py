@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+LoRTISA Record Linkage - REDCap events and duplicate patients
+Links records through hash indexes on normalized patient identifiers, collapses
+each patient's REDCap events into one wide record, and flags probable duplicate
+patients found within blocks of (hospital, enrolment date, initials).
+"""
+
+import re
+from collections import defaultdict
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+ID_COLUMNS = ['patient_id', 'patient_id1']
+EVENT_COLUMN = 'redcap_event_name'
+BASELINE_EVENT = 'baseline_arm_1'
+BLOCKING_COLUMNS = ['hospital', 'date_enrol', 'patient_initials1']
+
+# Fields compared between candidate pairs inside a block
+COMPARISON_FIELDS = ['patient_gender', 'patient_age', 'patient_dob', 'residencedistrict']
+
+# Study IDs are prefixed with the hospital's initial (K0006, M0560, N0136)
+_ID_PATTERN = re.compile(r'^([A-Z]*)0*(\d+)$')
+
+
+def normalize_id(value, hospital=None):
+    """
+    Normalize a patient identifier so that variants of the same study ID hash
+    alike: 'M0560', 'm560' and, at Mulago, '560' or 560.0 all become 'M560'.
+    IDs with separators or suffixes ('K0006-2') are kept as distinct keys.
+    """
+    if pd.isna(value):
+        return None
+    # Numeric ID columns with blanks are read as float: 1179.0 means 1179
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    text = re.sub(r'\.0+$', '', str(value).strip().upper())
+    match = _ID_PATTERN.match(text)
+    if not match:
+        return text or None
+    prefix, number = match.groups()
+    if not prefix and isinstance(hospital, str) and hospital:
+        prefix = hospital[0].upper()
+    return f"{prefix}{number}"
+
+
+def blocking_key(hospital, date_enrol, initials):
+    """Key for fuzzy candidate search; None when any component is missing."""
+    if pd.isna(hospital) or pd.isna(date_enrol) or pd.isna(initials):
+        return None
+    date = pd.to_datetime(date_enrol, errors='coerce')
+    initials = re.sub(r'[^A-Z]', '', str(initials).upper())
+    if pd.isna(date) or not initials:
+        return None
+    return (str(hospital).strip().title(), date.strftime('%Y-%m-%d'), initials)
+
+
+class _DisjointSet:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+
+def build_id_index(data):
+    """Hash index from normalized identifier to the row positions carrying it."""
+    index = defaultdict(list)
+    hospitals = data['hospital'].to_numpy() if 'hospital' in data else [None] * len(data)
+    for col in ID_COLUMNS:
+        if col not in data:
+            continue
+        for pos, (value, hospital) in enumerate(zip(data[col].to_numpy(), hospitals)):
+            key = normalize_id(value, hospital)
+            if key is not None:
+                index[key].append(pos)
+    return index
+
+
+def build_block_index(data):
+    """Hash index from blocking key to the row positions in that block."""
+    index = defaultdict(list)
+    columns = [data[col].to_numpy() for col in BLOCKING_COLUMNS]
+    for pos, values in enumerate(zip(*columns)):
+        key = blocking_key(*values)
+        if key is not None:
+            index[key].append(pos)
+    return index
+
+
+def _field_agreement(a, b, field):
+    """True/False for agreement, None when either side is missing."""
+    if pd.isna(a) or pd.isna(b):
+        return None
+    if field == 'patient_age':
+        return abs(float(a) - float(b)) <= 1
+    return str(a).strip().lower() == str(b).strip().lower()
+
+
+def _linked_groups(data):
+    """Row positions grouped by patient via any shared normalized identifier."""
+    groups = _DisjointSet(len(data))
+    for positions in build_id_index(data).values():
+        for pos in positions[1:]:
+            groups.union(positions[0], pos)
+    return np.array([groups.find(pos) for pos in range(len(data))], dtype=int)
+
+
+def _collapse_group(group):
+    """
+    Merge one patient's event rows into a wide record, baseline first.
+
+    Returns None when the rows are not distinct events of one patient (no event
+    column, repeated events, more than one baseline, or conflicting values);
+    such groups are duplicates or ID collisions and must not be merged.
+    """
+    if EVENT_COLUMN not in group or group[EVENT_COLUMN].isna().any():
+        return None
+    if group[EVENT_COLUMN].duplicated().any():
+        return None
+
+    is_baseline = (group[EVENT_COLUMN] == BASELINE_EVENT).to_numpy()
+    group = pd.concat([group[is_baseline], group[~is_baseline]])
+    record = group.iloc[0].copy()
+    compared = ~record.index.isin(ID_COLUMNS + [EVENT_COLUMN])
+    for _, row in group.iloc[1:].iterrows():
+        present = row.notna() & record.notna() & compared
+        if (row[present].astype(str) != record[present].astype(str)).any():
+            return None
+        record = record.combine_first(row)
+    return record
+
+
+def find_duplicate_candidates(linked, min_agreement=0.75, shared_id_groups=()):
+    """
+    Report probable duplicate pairs: every pair within a shared-ID group that
+    could not be collapsed, plus pairs compared only within blocks whose fields
+    agree on at least `min_agreement` of the fields present.
+    """
+    rows = []
+    fields = [f for f in COMPARISON_FIELDS if f in linked]
+    values = {f: linked[f].to_numpy() for f in fields}
+    ids = linked['linkage_id'].to_numpy()
+    block_columns = [linked[col].to_numpy() if col in linked else [None] * len(linked)
+                     for col in BLOCKING_COLUMNS]
+
+    def compare(i, j):
+        agreements = [_field_agreement(values[f][i], values[f][j], f) for f in fields]
+        compared = [a for a in agreements if a is not None]
+        score = sum(compared) / len(compared) if compared else np.nan
+        return len(compared), score
+
+    def add(i, j, match_type, n_compared, score):
+        block = [column[i] for column in block_columns]
+        key = blocking_key(*block) or tuple('' if pd.isna(v) else str(v) for v in block)
+        rows.append({
+            'linkage_id': ids[i],
+            'candidate_id': ids[j],
+            'match_type': match_type,
+            'hospital': key[0],
+            'date_enrol': key[1],
+            'initials': key[2],
+            'fields_compared': n_compared,
+            'agreement': score,
+        })
+
+    reported = set()
+    for positions in shared_id_groups:
+        for i, j in combinations(positions, 2):
+            add(i, j, 'shared_id', *compare(i, j))
+            reported.add((i, j))
+
+    for positions in build_block_index(linked).values():
+        for i, j in combinations(positions, 2):
+            if (i, j) in reported:
+                continue
+            n_compared, score = compare(i, j)
+            if n_compared and score >= min_agreement:
+                add(i, j, 'blocking', n_compared, score)
+
+    # Explicit dtypes keep the artifact schema stable when no pairs are found
+    dtypes = {
+        'linkage_id': str, 'candidate_id': str, 'match_type': str, 'hospital': str,
+        'date_enrol': str, 'initials': str, 'fields_compared': 'int64', 'agreement': 'float64',
+    }
+    candidates = pd.DataFrame(rows, columns=list(dtypes))
+    return candidates.astype(dtypes)
+
+
+def link_records(data, min_agreement=0.75):
+    """
+    Collapse each patient's REDCap events into one wide record, then flag
+    probable duplicates. Rows that share an identifier but are not distinct
+    events of one patient are kept apart and flagged rather than merged.
+
+    Returns (linked, candidates). `linked` gains linkage_id, n_source_records
+    and possible_duplicate; candidates lists flagged pairs.
+    """
+    data = data.reset_index(drop=True)
+    roots = _linked_groups(data)
+    group_sizes = np.bincount(roots, minlength=len(data))
+    multi = group_sizes[roots] > 1
+
+    merged = []
+    split = np.zeros(len(data), dtype=bool)
+    for root, group in data[multi].groupby(roots[multi], sort=False):
+        record = _collapse_group(group)
+        if record is None:
+            split[group.index] = True
+            continue
+        record['n_source_records'] = len(group)
+        record['_row'] = root
+        merged.append(record)
+
+    # Single records, and rows of groups that could not be collapsed, pass through
+    kept = ~multi | split
+    singles = data[kept].copy()
+    singles['n_source_records'] = 1
+    singles['_row'] = np.flatnonzero(kept)
+
+    linked = singles
+    if merged:
+        linked = pd.concat([singles, pd.DataFrame(merged)]).infer_objects()
+    linked = linked.sort_values('_row').reset_index(drop=True)
+    linked['n_source_records'] = linked['n_source_records'].astype(int)
+
+    # First usable identifier, else the source row; rows kept apart despite a
+    # shared identifier also carry their source row, so every id is unique
+    hospitals = linked['hospital'] if 'hospital' in linked else pd.Series(None, index=linked.index)
+    id_values = [linked[col] if col in linked else pd.Series(None, index=linked.index)
+                 for col in ID_COLUMNS]
+    linkage_ids = []
+    for row, hospital, *ids in zip(linked['_row'], hospitals, *id_values):
+        key = next((k for k in (normalize_id(v, hospital) for v in ids) if k is not None), None)
+        if key is None:
+            key = f"ROW{row}"
+        elif split[row]:
+            key = f"{key}/ROW{row}"
+        linkage_ids.append(key)
+    linked['linkage_id'] = linkage_ids
+
+    positions = pd.Series(np.arange(len(linked)), index=linked['_row'])
+    shared_id_groups = [
+        positions[rows].tolist()
+        for rows in pd.Series(np.flatnonzero(split)).groupby(roots[split]).agg(list)
+    ]
+    linked = linked.drop(columns='_row')
+
+    candidates = find_duplicate_candidates(linked, min_agreement, shared_id_groups)
+    flagged = set(candidates['linkage_id']) | set(candidates['candidate_id'])
+    linked['possible_duplicate'] = linked['linkage_id'].isin(flagged)
+    return linked, candidates
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+LoRTISA Results Store - Columnar result artifacts
+Writes analysis tables at full precision as Arrow (Feather v2) files with a
+machine-readable manifest; CSV and markdown outputs are rendered views of them
+"""
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pyarrow.feather as feather
+
+ARTIFACT_DIR = 'Results/Artifacts'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Return the hex SHA-256 digest of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_path(artifact_dir=ARTIFACT_DIR):
+    return os.path.join(artifact_dir, MANIFEST_NAME)
+
+
+def load_manifest(artifact_dir=ARTIFACT_DIR):
+    """Load the manifest, or an empty one if no artifacts have been written."""
+    path = manifest_path(artifact_dir)
+    if not os.path.exists(path):
+        return {'manifest_version': MANIFEST_VERSION, 'tables': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, artifact_dir=ARTIFACT_DIR):
+    """Write the manifest atomically so readers never see a partial file."""
+    os.makedirs(artifact_dir, exist_ok=True)
+    path = manifest_path(artifact_dir)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(tmp_path, path)
+
+
+def write_table(name, df, parameters=None, producer=None, artifact_dir=ARTIFACT_DIR):
+    """
+    Write a result table as an uncompressed Feather file and record it in the manifest.
+
+    The index is stored as ordinary columns (Feather has no index) and listed in the
+    manifest so read_table() can restore it. Files are written uncompressed so that
+    downstream jobs can memory-map them.
+    """
+    os.makedirs(artifact_dir, exist_ok=True)
+
+    index_columns = [c for c in df.index.names if c is not None]
+    frame = df.reset_index() if index_columns else df.reset_index(drop=True)
+
+    filename = f"{name}.arrow"
+    path = os.path.join(artifact_dir, filename)
+    tmp_path = path + '.tmp'
+    feather.write_feather(frame, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+    schema = feather.read_table(path, memory_map=True).schema
+    entry = {
+        'file': filename,
+        'format': 'arrow-ipc',
+        'rows': int(len(frame)),
+        'index_columns': index_columns,
+        'schema': [{'name': field.name, 'type': str(field.type)} for field in schema],
+        'sha256': file_sha256(path),
+        'parameters': parameters or {},
+        'producer': producer,
+    }
+
+    manifest = load_manifest(artifact_dir)
+    manifest['tables'][name] = entry
+    save_manifest(manifest, artifact_dir)
+    return entry
+
+
+def remove_table(name, artifact_dir=ARTIFACT_DIR):
+    """Drop a table that was not produced this run, so it cannot pass as fresh."""
+    manifest = load_manifest(artifact_dir)
+    entry = manifest['tables'].pop(name, None)
+    if entry is None:
+        return False
+    path = os.path.join(artifact_dir, entry['file'])
+    if os.path.exists(path):
+        os.remove(path)
+    save_manifest(manifest, artifact_dir)
+    return True
+
+
+def is_fresh(name, parameters=None, artifact_dir=ARTIFACT_DIR):
+    """
+    Check whether an artifact exists, matches its manifest hash and, if given,
+    was produced with the same parameters.
+    """
+    entry = load_manifest(artifact_dir)['tables'].get(name)
+    if entry is None:
+        return False
+    path = os.path.join(artifact_dir, entry['file'])
+    if not os.path.exists(path) or file_sha256(path) != entry['sha256']:
+        return False
+    return parameters is None or entry['parameters'] == parameters
+
+
+def read_table(name, verify=True, artifact_dir=ARTIFACT_DIR):
+    """Read a result table back (memory-mapped), optionally verifying its hash."""
+    entry = load_manifest(artifact_dir)['tables'].get(name)
+    if entry is None:
+        raise KeyError(f"No artifact named '{name}' in {manifest_path(artifact_dir)}")
+
+    path = os.path.join(artifact_dir, entry['file'])
+    if verify and file_sha256(path) != entry['sha256']:
+        raise ValueError(f"Artifact '{name}' does not match its manifest hash: {path}")
+
+    df = feather.read_table(path, memory_map=True).to_pandas()
+    if entry['index_columns']:
+        df = df.set_index(entry['index_columns'])
+    return df
+
+
+def render_csv(name, csv_path, decimals=1, index=True, artifact_dir=ARTIFACT_DIR):
+    """Render an artifact as a rounded CSV view for human consumption."""
+    df = read_table(name, artifact_dir=artifact_dir)
+    if decimals is not None:
+        df = df.round(decimals)
+    df.to_csv(csv_path, index=index and bool(df.index.names[0]))
+    return csv_path
+
+
+def render_markdown(name, decimals=1, artifact_dir=ARTIFACT_DIR):
+    """Render an artifact as a GitHub-flavoured markdown table."""
+    df = read_table(name, artifact_dir=artifact_dir)
+    if df.index.names[0] is not None:
+        df = df.reset_index()
+
+    def fmt(value):
+        if isinstance(value, float):
+            return 'NA' if pd.isna(value) else f"{value:.{decimals}f}"
+        return str(value)
+
+    lines = [
+        '| ' + ' | '.join(str(c) for c in df.columns) + ' |',
+        '|' + '|'.join(['---'] * len(df.columns)) + '|',
+    ]
+    for row in df.itertuples(index=False):
+        lines.append('| ' + ' | '.join(fmt(v) for v in row) + ' |')
+    return '\n'.join(lines)